@@ -2,10 +2,10 @@
 """aliasdb.py.
 
 Usage:
-    aliasdb.py -a <name> <command>
-    aliasdb.py -r <name>
+    aliasdb.py [--json=FILE|--yaml=FILE] -a <name> <command>
+    aliasdb.py [--json=FILE|--yaml=FILE] -r <name>
     aliasdb.py [--json=FILE|--yaml=FILE] -s [-o OUTPUT]
-    aliasdb.py <name> [-o OUTPUT]
+    aliasdb.py [--json=FILE|--yaml=FILE] <name> [-o OUTPUT]
     aliasdb.py (-h | --help)
 
 Options:
@@ -24,48 +24,46 @@ __version__ = '1.0'
 __license__ = 'CC0'
 
 import abc
+import contextlib
+import io
 import os
+import stat
 import sys
-import json
-import yaml
+from dataclasses import dataclass
 from pathlib import Path
-from docopt import docopt
 
 
+@dataclass(frozen=True, slots=True)
 class Alias:
     """
     Represends a binding of a name to a command.
     """
-    def __init__(self, alias_name, command, category=None):
-        self.alias_name = alias_name
-        self.command = command
-        self.category = category
-        if category == "":
-            self.category = None
+    alias_name: str
+    command: str
+    category: str | None = None
+
+    def __post_init__(self):
+        if self.category == "":
+            object.__setattr__(self, 'category', None)
 
     def __eq__(self, other):
-        if other is None:
-            return False
-        if not isinstance(other, Alias):
-            return False
-        return ((self.alias_name == other.alias_name) and
-                (self.command == other.command) and
-                (self.category == other.category))
+        # Compare field by field so that differing names, which are
+        # short, short-circuit before the longer commands are compared.
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self.alias_name == other.alias_name and
+                self.command == other.command and
+                self.category == other.category)
 
-    def __ne__(self, other):
-        return not self == other
 
-    def __repr__(self):
-        return str((self.alias_name, self.command, self.category))
+_ESCAPE_TABLE = str.maketrans({'"': '\\"', "'": "\\'"})
 
 
 def escape(string):
     """
     Escape quotes in a given string.
     """
-    string = string.replace('"', '\\"')
-    string = string.replace("'", "\\'")
-    return string
+    return string.translate(_ESCAPE_TABLE)
 
 
 def get_sh_alias_command(alias_name, command):
@@ -73,17 +71,7 @@ def get_sh_alias_command(alias_name, command):
     Output a line of sh script that makes a shell
     alias based on alias_name and command.
     """
-    return 'alias %s="%s"\n' % (alias_name, escape(command))
-
-
-def aliases_to_tuplelist(aliases):
-    """
-    Convert a dict containing aliases to a sorted list to tuples.
-    """
-    alias_list = []
-    for key, value in aliases.items():
-        alias_list.append((key, value.command))
-    return sorted(alias_list)
+    return f'alias {alias_name}="{command.translate(_ESCAPE_TABLE)}"\n'
 
 
 class AliasDB:
@@ -99,26 +87,63 @@ class AliasDB:
         """
         self.backend.add_alias(alias)
 
+    def add_aliases(self, aliases):
+        """
+        Adds several Aliases to the database, writing it out only once.
+        """
+        with self.bulk():
+            for alias in aliases:
+                self.backend.add_alias(alias)
+
     def remove_alias(self, alias_name):
         """
         Removes an aliias from the database.
         """
         self.backend.remove_alias(alias_name)
 
+    def flush(self):
+        """
+        Writes any unsaved changes out to the database.
+        """
+        self.backend.flush()
+
+    @contextlib.contextmanager
+    def bulk(self):
+        """
+        Context manager that defers writing changes out to the database
+        until the outermost bulk() block exits normally. If the block
+        raises, the changes made inside it are discarded instead.
+        """
+        autoflush = self.backend.autoflush
+        self.backend.autoflush = False
+        try:
+            yield self
+        except BaseException:
+            if autoflush:
+                self.backend.discard_changes()
+            raise
+        finally:
+            self.backend.autoflush = autoflush
+        if autoflush:
+            self.flush()
+
     def get_sh_script(self):
         """
         Gets a sh script containing all the alias commands.
         """
-        script = ""
-        aliases = self.get_aliases()
+        aliases = self.backend.load_aliases()
 
-        alias_list = aliases_to_tuplelist(aliases)
+        lines = [get_sh_alias_command(alias_name, aliases[alias_name].command)
+                 for alias_name in sorted(aliases)]
 
-        for alias in alias_list:
-            new_line = get_sh_alias_command(alias[0], alias[1])
-            script = script + new_line
+        return "".join(lines)
 
-        return script
+    def get_sh_script_bytes(self):
+        """
+        Gets the sh script encoded as UTF-8, ready to be written to a
+        binary file.
+        """
+        return self.get_sh_script().encode()
 
     def get_aliases(self):
         """
@@ -130,7 +155,7 @@ class AliasDB:
         """
         Gets a single alias based on it's name.
         """
-        return self.get_aliases().get(alias_name, None)
+        return self.backend.get_alias(alias_name)
 
 
 def dict_to_alias(alias, item):
@@ -144,11 +169,7 @@ def dicts_to_aliases(dlist):
     """
     Convert a dictionary of dictionaries to a dictionary of Alias objects.
     """
-    olist = {}
-    for item in dlist:
-        alias = dict_to_alias(item, dlist[item])
-        olist[item] = alias
-    return olist
+    return {name: dict_to_alias(name, item) for name, item in dlist.items()}
 
 
 def alias_to_dict(alias):
@@ -165,10 +186,7 @@ def aliases_to_dicts(adict):
     """
     Convert a dictionary of aliases to a dictionary of dictionaries.
     """
-    ddict = {}
-    for key, value in adict.items():
-        ddict[key] = alias_to_dict(value)
-    return ddict
+    return {key: alias_to_dict(value) for key, value in adict.items()}
 
 
 class AliasBackend(metaclass=abc.ABCMeta):
@@ -176,46 +194,151 @@ class AliasBackend(metaclass=abc.ABCMeta):
     The interface to the database storage for aliases.
     """
 
-    def __init__(self, fp):
+    def __init__(self, fp, path=None):
         self.fp = fp
+        self.path = path
+        self.autoflush = True
+        self._dirty = False
+        self._dicts = None
+        self._aliases = None
 
     def remove_alias(self, alias_name):
         """
         Remove an alias from the file.
         """
-        aliases = self.get_aliases()
+        aliases = self.load_aliases_for_update()
         del aliases[alias_name]
-        self.write_aliases(aliases)
+        self.mark_dirty()
 
     def add_alias(self, alias):
         """
-        Adds an alias to the JSON file.
+        Adds an alias to the file.
         """
-        aliases = self.get_aliases()
+        aliases = self.load_aliases_for_update()
+        if aliases.get(alias.alias_name, None) == alias:
+            return
         aliases[alias.alias_name] = alias
-        self.write_aliases(aliases)
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        """
+        Records that the cached aliases have changed,
+        writing them out straight away if autoflush is set.
+        """
+        self._dirty = True
+        if self.autoflush:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the cached aliases to the file if they have changed.
+        """
+        if self._dirty:
+            self.write_aliases(self._aliases)
+
+    def discard_changes(self):
+        """
+        Drops any unsaved changes, so aliases are read from the file again.
+        """
+        self._dirty = False
+        self._dicts = None
+        self._aliases = None
 
     def get_aliases(self):
         """
         Returns a dictionary of Aliases read from the file.
         """
-        self.fp.seek(0)
+        return dict(self.load_aliases())
+
+    def get_alias(self, alias_name):
+        """
+        Returns a single Alias by name, or None if it doesn't exist.
+        """
+        if self._aliases is not None:
+            return self._aliases.get(alias_name, None)
 
-        d = self.get_aliases_as_dicts()
+        item = self.load_dicts().get(alias_name, None)
+        if item is None:
+            return None
+        return dict_to_alias(alias_name, item)
 
-        aliases = d.get('aliases', {})
-        aliases = dicts_to_aliases(aliases)
-        return aliases
+    def load_aliases(self):
+        """
+        Returns the cached dictionary of Aliases,
+        reading it from the file on first use.
+        """
+        if self._aliases is None:
+            self._aliases = dicts_to_aliases(self.load_dicts())
+            self._dicts = None
+        return self._aliases
 
-    def write_aliases(self, aliases):
+    def load_aliases_for_update(self):
         """
-        Writes out a dict of aliases to the file.
+        Returns the cached dictionary of Aliases for a change to be made
+        to it and written back out.
+        """
+        return self.load_aliases()
+
+    def load_dicts(self):
+        """
+        Returns the cached aliases as a dictionary of dictionaries,
+        reading it from the file on first use.
+        """
+        if self._dicts is None:
+            d = self.read_file()
+
+            self._dicts = d.get('aliases', {})
+        return self._dicts
+
+    def read_file(self):
+        """
+        Reads the whole file as a dictionary of dictionaries.
         """
         self.fp.seek(0)
-        aliases = aliases_to_dicts(aliases)
+        return self.get_aliases_as_dicts()
+
+    def write_aliases(self, adict):
+        """
+        Writes out a dict of aliases to the file.
+        """
+        aliases = aliases_to_dicts(adict)
         aliases = {'aliases': aliases}
-        self.write_aliases_as_dicts(aliases)
-        self.fp.truncate()
+        self.write_file(aliases)
+        self._dirty = False
+        self._dicts = None
+        self._aliases = dict(adict)
+
+    def write_file(self, dicts):
+        """
+        Replaces the contents of the file with dictionary.
+        """
+        if self.path is None:
+            self.fp.seek(0)
+            self.write_aliases_as_dicts(dicts)
+            self.fp.truncate()
+        else:
+            self.replace_file(dicts)
+
+    def replace_file(self, dicts):
+        """
+        Writes dictionary to a temporary file next to path and renames
+        it over path, so the file is never left half written.
+        """
+        import tempfile
+        path = Path(os.path.realpath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name)
+        old_fp, self.fp = self.fp, os.fdopen(fd, 'w+')
+        try:
+            os.chmod(tmp_path, stat.S_IMODE(os.fstat(old_fp.fileno()).st_mode))
+            self.write_aliases_as_dicts(dicts)
+            self.fp.flush()
+            os.replace(tmp_path, path)
+        except BaseException:
+            self.fp.close()
+            self.fp = old_fp
+            os.unlink(tmp_path)
+            raise
+        old_fp.close()
 
     @abc.abstractmethod
     def get_aliases_as_dicts(self):
@@ -227,29 +350,180 @@ class AliasBackend(metaclass=abc.ABCMeta):
         """Writes dictionary to the file."""
         raise NotImplementedError("Please Implement this method")
 
+
+class DictBackend(AliasBackend):
+    """
+    An in-memory Backend for AliasDB, keeping aliases as a dictionary of
+    dictionaries instead of in a file.
+    """
+    def __init__(self, dicts=None):
+        super().__init__(None)
+        self.dicts = {'aliases': {} if dicts is None else dicts}
+
+    def read_file(self):
+        return self.get_aliases_as_dicts()
+
+    def write_file(self, dicts):
+        self.write_aliases_as_dicts(dicts)
+
+    def get_aliases_as_dicts(self):
+        return self.dicts
+
+    def write_aliases_as_dicts(self, dicts):
+        self.dicts = dicts
+
+
 class JSONBackend(AliasBackend):
     """
     A JSON Backend for AliasDB.
     """
+    json = None
+    loads = None
+
+    @classmethod
+    def import_json(cls):
+        """
+        Imports json on first use, along with orjson's faster loads if it
+        is installed.
+        """
+        if cls.json is None:
+            import json
+            cls.json = json
+            try:
+                from orjson import loads
+            except ImportError:
+                loads = json.loads
+            cls.loads = staticmethod(loads)
+
     def get_aliases_as_dicts(self):
+        self.import_json()
+        data = self.fp.read()
+        if not data:
+            return {}
+
         try:
-            d = json.load(self.fp)
+            d = self.loads(data)
         except:
             return {}
         return d
 
     def write_aliases_as_dicts(self, dicts):
-        json.dump(dicts, self.fp,
-                  indent=4, sort_keys=True)
+        self.import_json()
+        data = self.json.dumps(dicts, indent=4, sort_keys=True)
+        if isinstance(self.fp, (io.RawIOBase, io.BufferedIOBase)):
+            data = data.encode()
+        self.fp.write(data)
 
 
 class YAMLBackend(AliasBackend):
     """
     A YAML Backend for AliasDB.
+
+    When backed by a path, the parsed aliases are also kept in a JSON
+    cache file next to it. The cache is read instead of the much slower
+    to parse YAML while the YAML file's mtime and size match the ones
+    recorded in the cache. Changes are always made on top of the YAML.
     """
+    yaml = None
+    loader = None
+    dumper = None
+
+    def __init__(self, fp, path=None):
+        super().__init__(fp, path)
+        self.use_cache = path is not None
+        self.from_cache = False
+
+    @classmethod
+    def import_yaml(cls):
+        """
+        Imports PyYAML on first use, as it is slow to import and isn't
+        needed when the JSON cache is fresh or by JSON users at all.
+        """
+        if cls.yaml is None:
+            import yaml
+            cls.yaml = yaml
+            cls.loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+            cls.dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+    def get_cache_path(self):
+        """
+        Returns the path of the JSON cache file for path.
+        """
+        return Path(str(self.path) + '.cache.json')
+
+    def get_file_version(self):
+        """
+        Returns the YAML file's mtime and size, which a cache must have
+        been written for to be used.
+        """
+        st = os.fstat(self.fp.fileno())
+        return [st.st_mtime_ns, st.st_size]
+
+    def load_aliases_for_update(self):
+        self.use_cache = False
+        if self.from_cache:
+            self.from_cache = False
+            self._dicts = None
+            self._aliases = None
+        return super().load_aliases_for_update()
+
+    def read_file(self):
+        if self.use_cache:
+            d = self.read_cache()
+            if d is not None:
+                self.from_cache = True
+                return d
+
+        d = super().read_file()
+        # Reads for an update are followed by a write, which refreshes the
+        # cache anyway.
+        if self.use_cache:
+            self.write_cache(d)
+        return d
+
+    def write_file(self, dicts):
+        super().write_file(dicts)
+        if self.path is not None:
+            self.write_cache(dicts)
+
+    def read_cache(self):
+        """
+        Returns the dictionary stored in the JSON cache file, or None if
+        it is missing, unreadable or was written for a different version
+        of the YAML file.
+        """
+        JSONBackend.import_json()
+        try:
+            with self.get_cache_path().open() as f:
+                cache = JSONBackend.loads(f.read())
+            if cache['version'] == self.get_file_version():
+                return cache['document']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def write_cache(self, dicts):
+        """
+        Writes dictionary to the JSON cache file, ignoring failures as the
+        YAML file is always the authoritative copy. Nothing is written if
+        the dictionary doesn't survive a round trip through JSON unchanged,
+        e.g. when YAML parsed an alias name as a bool or int.
+        """
+        JSONBackend.import_json()
+        try:
+            cache = {'version': self.get_file_version(), 'document': dicts}
+            data = JSONBackend.json.dumps(cache)
+            if JSONBackend.loads(data)['document'] != dicts:
+                return
+            with self.get_cache_path().open('w') as f:
+                f.write(data)
+        except (OSError, TypeError, ValueError):
+            pass
+
     def get_aliases_as_dicts(self):
+        self.import_yaml()
         try:
-            d = yaml.load(self.fp)
+            d = self.yaml.load(self.fp, Loader=self.loader)
         except:
             return {}
 
@@ -259,19 +533,17 @@ class YAMLBackend(AliasBackend):
         return d
 
     def write_aliases_as_dicts(self, dicts):
-        yaml.dump(dicts, self.fp,
-                  default_flow_style=False, indent=4)
+        self.import_yaml()
+        self.yaml.dump(dicts, self.fp, Dumper=self.dumper,
+                       default_flow_style=False, indent=4)
 
 
 def open_file(path):
     """
     Opens a file given by path. If the file doesn't exist try and create it.
     """
-    if not path.exists():
-        f = path.open('w')
-        f.close()
-    f = path.open('r+')
-    return f
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+    return os.fdopen(fd, 'r+')
 
 
 def make_json_aliasdb(path):
@@ -279,7 +551,7 @@ def make_json_aliasdb(path):
     Makes an Aliases class with a JSON backend from the file given by path.
     """
     f = open_file(path)
-    backend = JSONBackend(f)
+    backend = JSONBackend(f, path)
     aliases = AliasDB(backend)
     return aliases
 
@@ -289,35 +561,39 @@ def make_yaml_aliasdb(path):
     Makes an Aliases class with a YAML backend from the file given by path.
     """
     f = open_file(path)
-    backend = YAMLBackend(f)
+    backend = YAMLBackend(f, path)
     aliases = AliasDB(backend)
     return aliases
 
 
 def get_outfile(filename):
     """
-    Returns a file for output from the filename.
-    If file name is '-' then sys.stdout is used.
+    Returns a binary file for output from the filename.
+    If file name is '-' then sys.stdout's buffer is used, or sys.stdout
+    itself if it has been replaced by a text stream without one.
     """
     if filename == '-':
-        return sys.stdout
+        return getattr(sys.stdout, 'buffer', sys.stdout)
 
-    return open(filename, 'w')
+    return open(filename, 'wb')
 
 
 def process_opts(opts, aliases):
     """
-    Takes a dictionary of options in the format output by docopt
+    Takes a dictionary of options in the format output by parse_args
     and talks to the alias database baned on them.
     """
     out = get_outfile(opts.get('--output', '-'))
+    binary = 'b' in getattr(out, 'mode', '')
 
     if opts['-a']:
         alias = Alias(opts['-a'], opts['<command>'])
         aliases.add_alias(alias)
     elif opts['-s']:
-        script = aliases.get_sh_script()
-        out.write(script)
+        if binary:
+            out.write(aliases.get_sh_script_bytes())
+        else:
+            out.write(aliases.get_sh_script())
     elif opts.get('--remove', None) is not None:
         try:
             aliases.remove_alias(opts['--remove'])
@@ -326,21 +602,59 @@ def process_opts(opts, aliases):
     elif opts.get('<name>', None) is not None:
         alias = aliases.get_alias(opts['<name>'])
         if alias is not None:
-            out.write(get_sh_alias_command(opts['<name>'], alias.command))
+            command = get_sh_alias_command(opts['<name>'], alias.command)
+            out.write(command.encode() if binary else command)
 
     out.close()
 
 
+def parse_args(args):
+    """
+    Parse the list of commandline arguments given in args (without the
+    executable name) into a dictionary of options keyed by option name.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='aliasdb.py')
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument('-s', action='store_true', dest='-s',
+                        help='Generate shell script.')
+    action.add_argument('-a', nargs=2, metavar=('<name>', '<command>'),
+                        dest='-a',
+                        help='Add alias to database. '
+                             'Will override any alias with the same name.')
+    action.add_argument('-r', '--remove', metavar='<name>', dest='--remove',
+                        help='Remove an alias from the database.')
+    action.add_argument('<name>', nargs='?',
+                        help='Print the sh alias command for an alias.')
+    backend = parser.add_mutually_exclusive_group()
+    backend.add_argument('-j', '--json', metavar='FILE', dest='--json',
+                         help='Read/store aliases as JSON file.')
+    backend.add_argument('-y', '--yaml', metavar='FILE', dest='--yaml',
+                         default='~/.config/aliases.yaml',
+                         help='Read/store aliases as YAML file. '
+                              '[default: %(default)s]')
+    parser.add_argument('-o', '--output', metavar='OUTPUT', dest='--output',
+                        default='-', help='Output to file [default: -]')
+
+    opts = vars(parser.parse_args(args))
+    if not (opts['-s'] or opts['-a'] or opts['--remove'] is not None or
+            opts['<name>'] is not None):
+        parser.error('one of -s, -a, -r/--remove or <name> is required')
+    opts['-a'], opts['<command>'] = opts['-a'] or (None, None)
+    return opts
+
+
 def main_opts(opts):
     """
     Run the program using the options given in opts which is expected
-    to be a dictionary in the format output by docopt.
+    to be a dictionary in the format output by parse_args.
     """
     if opts.get('--json', None) is not None:
-        json_path = Path(os.path.expanduser(opts['--json']))
+        json_path = Path(opts['--json']).expanduser()
         aliases = make_json_aliasdb(json_path)
     else:
-        yaml_path = Path(os.path.expanduser(opts['--yaml']))
+        yaml_path = Path(opts['--yaml']).expanduser()
         aliases = make_yaml_aliasdb(yaml_path)
     process_opts(opts, aliases)
 
@@ -350,7 +664,7 @@ def main(args):
     Run the program using the list of commandline arguments given in args.
     args[0] is expected to be the executable name.
     """
-    opts = docopt(__doc__, args[1:])
+    opts = parse_args(args[1:])
     main_opts(opts)
 
 
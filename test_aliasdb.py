@@ -1,23 +1,49 @@
 import unittest
+import contextlib
 import io
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
 import aliasdb
 from aliasdb import Alias, AliasDB, JSONBackend
 
 
 class FakeAliasDatabase():
     def __init__(self):
-        self.aliases = []
+        self.aliases = {}
 
     def add_alias(self, alias):
-        self.aliases.append(alias)
+        self.aliases[alias.alias_name] = alias
 
     def get_aliases(self):
         return self.aliases
 
 
+FAKE_ALIASES = {'lst': Alias("lst", "ls -lhar --sort time"),
+                'lss': Alias("lss", "ls -lhar --sort time")}
+
+
 def make_fake_aliases():
-    return {'lst': Alias("lst", "ls -lhar --sort time"),
-            'lss': Alias("lss", "ls -lhar --sort time")}
+    return dict(FAKE_ALIASES)
+
+
+EXAMPLE_ALIAS_DICTS = {
+    "lst": {
+        'command': 'ls -lhar --sort time',
+        'category': None
+    },
+    "lss": {
+        'command': 'ls -lhar --sort size',
+        'category': None
+    }
+}
+
+EXAMPLE_ALIASES = {
+    'lst': Alias('lst', 'ls -lhar --sort time'),
+    'lss': Alias('lss', 'ls -lhar --sort size')
+}
 
 
 class TestAliasObj(unittest.TestCase):
@@ -29,27 +55,19 @@ class TestAliasObj(unittest.TestCase):
         self.assertEqual(a1, a2)
         self.assertNotEqual(a1, a3)
         self.assertNotEqual(a1, None)
+        self.assertNotEqual(a1, 'lst')
 
-    def test_dicts_to_aliases(self):
-        example = {
-            "lst": {
-                'command': 'ls -lhar --sort time',
-                'category': None
-            },
-            "lss": {
-                'command': 'ls -lhar --sort size',
-                'category': None
-            }
-        }
+    def test_hash(self):
+        a1 = Alias('lst', 'ls -lhar --sort time')
+        a2 = Alias('lst', 'ls -lhar --sort time')
 
-        expected = {
-            'lst': Alias('lst', 'ls -lhar --sort time'),
-            'lss': Alias('lss', 'ls -lhar --sort size')
-        }
+        self.assertEqual(hash(a1), hash(a2))
+        self.assertEqual(len({a1, a2}), 1)
 
-        result = aliasdb.dicts_to_aliases(example)
+    def test_dicts_to_aliases(self):
+        result = aliasdb.dicts_to_aliases(EXAMPLE_ALIAS_DICTS)
 
-        self.assertDictEqual(result, expected)
+        self.assertDictEqual(result, EXAMPLE_ALIASES)
 
 
 SIMPLE_ALIAS_YAML = """\
@@ -111,6 +129,88 @@ aliases:
         self.assertEqual('alias lss="ls -lhar --sort size"\n' +
                          'alias lst="ls -lhar --sort time"\n', script)
 
+    def test_json_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / 'aliases.yaml'
+            adb = aliasdb.make_yaml_aliasdb(path)
+            adb.add_alias(Alias("lst", "ls -lhar --sort time"))
+            adb.backend.fp.close()
+
+            cache_path = Path(tmpdir) / 'aliases.yaml.cache.json'
+            cache = json.loads(cache_path.read_text())
+            cache['document']['aliases']['lst']['command'] = 'cached'
+            cache_path.write_text(json.dumps(cache))
+
+            adb = aliasdb.make_yaml_aliasdb(path)
+            cached = adb.get_sh_script()
+            adb.add_alias(Alias("lss", "ls -lhar --sort size"))
+            updated = adb.get_sh_script()
+            adb.backend.fp.close()
+
+            path.write_text(SIMPLE_ALIAS_YAML.replace('time', 'size'))
+            mtime = path.stat().st_mtime_ns + 1000000000
+            os.utime(path, ns=(mtime, mtime))
+
+            adb = aliasdb.make_yaml_aliasdb(path)
+            edited = adb.get_sh_script()
+            adb.backend.fp.close()
+
+        self.assertEqual('alias lst="cached"\n', cached)
+        self.assertEqual('alias lss="ls -lhar --sort size"\n' +
+                         'alias lst="ls -lhar --sort time"\n', updated)
+        self.assertEqual('alias lst="ls -lhar --sort size"\n', edited)
+
+    def test_json_cache_non_str_name(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / 'aliases.yaml'
+            path.write_text('aliases:\n' +
+                            '    on:\n' +
+                            '        command: x\n' +
+                            '        category: null\n')
+
+            scripts = []
+            for i in range(2):
+                adb = aliasdb.make_yaml_aliasdb(path)
+                scripts.append(adb.get_sh_script())
+                adb.backend.fp.close()
+
+            cache_path = Path(tmpdir) / 'aliases.yaml.cache.json'
+            self.assertFalse(cache_path.exists())
+
+        self.assertEqual(['alias True="x"\n'] * 2, scripts)
+
+    def test_json_cache_older_copy(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / 'aliases.yaml'
+            adb = aliasdb.make_yaml_aliasdb(path)
+            adb.add_alias(Alias("lst", "ls -lhar --sort time"))
+            adb.backend.fp.close()
+
+            synced_path = Path(tmpdir) / 'synced.yaml'
+            synced_path.write_text(SIMPLE_ALIAS_YAML +
+                                   '    synced:\n' +
+                                   '        command: "ls -lhar"\n' +
+                                   '        category: null\n')
+            os.utime(synced_path, (1577836800, 1577836800))
+            shutil.copy2(synced_path, path)
+
+            adb = aliasdb.make_yaml_aliasdb(path)
+            synced = adb.get_sh_script()
+            adb.backend.fp.close()
+
+            adb = aliasdb.make_yaml_aliasdb(path)
+            adb.add_alias(Alias("z", "zz"))
+            adb.backend.fp.close()
+
+            adb = make_test_yaml_aliasdb(io.StringIO(path.read_text()))
+            written = adb.get_sh_script()
+
+        self.assertEqual('alias lst="ls -lhar --sort time"\n' +
+                         'alias synced="ls -lhar"\n', synced)
+        self.assertEqual('alias lst="ls -lhar --sort time"\n' +
+                         'alias synced="ls -lhar"\n' +
+                         'alias z="zz"\n', written)
+
 
 SIMPLE_ALIAS_JSON = """
 {
@@ -124,6 +224,9 @@ SIMPLE_ALIAS_JSON = """
 """
 
 
+SIMPLE_ALIAS_DICTS = json.loads(SIMPLE_ALIAS_JSON)['aliases']
+
+
 def make_simple_alias_json_stringio():
     return io.StringIO(SIMPLE_ALIAS_JSON)
 
@@ -143,6 +246,19 @@ class TestJSON(unittest.TestCase):
         script = adb.get_sh_script()
         self.assertEqual(script, 'alias lst="ls -lhar --sort time"\n')
 
+    def test_parse_alias_bytes(self):
+        f = io.BytesIO(SIMPLE_ALIAS_JSON.encode())
+        adb = make_test_json_aliasdb(f)
+        script = adb.get_sh_script()
+        self.assertEqual(script, 'alias lst="ls -lhar --sort time"\n')
+
+        adb.add_alias(Alias("lss", "ls -lhar --sort size"))
+
+        adb = make_test_json_aliasdb(f)
+        self.assertEqual('alias lss="ls -lhar --sort size"\n' +
+                         'alias lst="ls -lhar --sort time"\n',
+                         adb.get_sh_script())
+
     def test_add_alias(self):
         adb = make_test_json_aliasdb()
 
@@ -166,6 +282,89 @@ class TestJSON(unittest.TestCase):
         aliases = adb.get_aliases()
         self.assertEqual(len(aliases), 2)
 
+    def test_get_alias(self):
+        f = make_simple_alias_json_stringio()
+        adb = make_test_json_aliasdb(f)
+
+        self.assertEqual(adb.get_alias('lst'),
+                         Alias('lst', 'ls -lhar --sort time'))
+        self.assertIsNone(adb.get_alias('missing'))
+
+    def test_add_existing_alias(self):
+        f = make_simple_alias_json_stringio()
+        adb = make_test_json_aliasdb(f)
+
+        adb.add_alias(Alias("lst", "ls -lhar --sort time"))
+
+        self.assertEqual(SIMPLE_ALIAS_JSON, f.getvalue())
+
+    def test_write_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / 'aliases.json'
+            adb = aliasdb.make_json_aliasdb(path)
+
+            adb.add_alias(Alias("lst", "ls -lhar --sort time"))
+            adb.add_alias(Alias("lss", "ls -lhar --sort size"))
+            adb.backend.fp.close()
+
+            self.assertEqual([path], list(Path(tmpdir).iterdir()))
+            adb = aliasdb.make_json_aliasdb(path)
+            script = adb.get_sh_script()
+            adb.backend.fp.close()
+
+        self.assertEqual('alias lss="ls -lhar --sort size"\n' +
+                         'alias lst="ls -lhar --sort time"\n', script)
+
+    def test_deferred_flush(self):
+        f = io.StringIO()
+        adb = make_test_json_aliasdb(f)
+        adb.backend.autoflush = False
+
+        adb.add_alias(Alias("lst", "ls -lhar --sort time"))
+        self.assertEqual('', f.getvalue())
+        self.assertEqual('alias lst="ls -lhar --sort time"\n',
+                         adb.get_sh_script())
+
+        adb.flush()
+        self.assertIn('"lst"', f.getvalue())
+
+    def test_add_aliases(self):
+        f = io.StringIO()
+        adb = make_test_json_aliasdb(f)
+
+        with adb.bulk():
+            adb.add_alias(Alias("lst", "ls -lhar --sort time"))
+            self.assertEqual('', f.getvalue())
+        adb.add_aliases([Alias("lss", "ls -lhar --sort size")])
+
+        adb = make_test_json_aliasdb(f)
+        self.assertEqual('alias lss="ls -lhar --sort size"\n' +
+                         'alias lst="ls -lhar --sort time"\n',
+                         adb.get_sh_script())
+
+    def test_bulk_error(self):
+        f = make_simple_alias_json_stringio()
+        adb = make_test_json_aliasdb(f)
+
+        with self.assertRaises(RuntimeError):
+            with adb.bulk():
+                adb.add_alias(Alias("lss", "ls -lhar --sort size"))
+                raise RuntimeError()
+
+        self.assertEqual(SIMPLE_ALIAS_JSON, f.getvalue())
+        self.assertEqual(['lst'], list(adb.get_aliases()))
+
+    def test_nested_bulk(self):
+        f = io.StringIO()
+        adb = make_test_json_aliasdb(f)
+
+        with adb.bulk():
+            with adb.bulk():
+                adb.add_alias(Alias("lst", "ls -lhar --sort time"))
+            self.assertEqual('', f.getvalue())
+
+        self.assertIn('"lst"', f.getvalue())
+
     def test_change_alias(self):
         adb = make_test_json_aliasdb()
 
@@ -177,6 +376,32 @@ class TestJSON(unittest.TestCase):
         self.assertEqual('alias lss="ls -lha --sort size"\n', script)
 
 
+def make_test_dict_aliasdb(dicts=None):
+    backend = aliasdb.DictBackend(dicts)
+    adb = AliasDB(backend)
+    return adb
+
+
+class TestDict(unittest.TestCase):
+    def test_parse_alias(self):
+        adb = make_test_dict_aliasdb(SIMPLE_ALIAS_DICTS)
+        script = adb.get_sh_script()
+        self.assertEqual(script, 'alias lst="ls -lhar --sort time"\n')
+
+    def test_get_aliases(self):
+        adb = make_test_dict_aliasdb(EXAMPLE_ALIAS_DICTS)
+
+        self.assertEqual(EXAMPLE_ALIASES, adb.get_aliases())
+
+    def test_remove_alias(self):
+        adb = make_test_dict_aliasdb(EXAMPLE_ALIAS_DICTS)
+
+        adb.remove_alias('lss')
+
+        self.assertEqual(['lst'], list(adb.get_aliases()))
+        self.assertEqual(2, len(EXAMPLE_ALIAS_DICTS))
+
+
 class TestScript(unittest.TestCase):
     def test_abstract_backend_fail(self):
         self.assertRaises(
@@ -184,7 +409,7 @@ class TestScript(unittest.TestCase):
         )
 
     def test_contains_singlequote(self):
-        adb = make_test_json_aliasdb()
+        adb = make_test_dict_aliasdb()
 
         adb.add_alias(Alias('test', "echo 'This contains quotes'"))
         result = adb.get_sh_script()
@@ -193,7 +418,7 @@ class TestScript(unittest.TestCase):
         self.assertEqual(expected, result)
 
     def test_contains_doublequotes(self):
-        adb = make_test_json_aliasdb()
+        adb = make_test_dict_aliasdb()
 
         adb.add_alias(Alias('test', 'echo "This contains quotes"'))
         result = adb.get_sh_script()
@@ -201,11 +426,53 @@ class TestScript(unittest.TestCase):
         expected = "alias test=\"echo \\\"This contains quotes\\\"\"\n"
         self.assertEqual(expected, result)
 
+    def test_script_bytes(self):
+        adb = make_test_dict_aliasdb()
+
+        adb.add_alias(Alias('caf', 'echo café'))
+        result = adb.get_sh_script_bytes()
+
+        self.assertEqual(b'alias caf="echo caf\xc3\xa9"\n', result)
+
     def test_contains_brackets(self):
-        adb = make_test_json_aliasdb()
+        adb = make_test_dict_aliasdb()
 
         adb.add_alias(Alias('hasbrackets', 'echo (This is in brackets)'))
         result = adb.get_sh_script()
 
         expected = 'alias hasbrackets="echo (This is in brackets)"\n'
         self.assertEqual(expected, result)
+
+
+class TestOptions(unittest.TestCase):
+    def test_no_action(self):
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertRaises(SystemExit, aliasdb.parse_args,
+                              ['--yaml=aliases.yaml'])
+
+    def test_add(self):
+        opts = aliasdb.parse_args(['-a', 'lst', 'ls -lhar --sort time'])
+
+        self.assertEqual(opts['-a'], 'lst')
+        self.assertEqual(opts['<command>'], 'ls -lhar --sort time')
+        self.assertFalse(opts['-s'])
+
+    def test_script(self):
+        opts = aliasdb.parse_args(['--json=aliases.json', '-s', '-o', 'out'])
+
+        self.assertTrue(opts['-s'])
+        self.assertIsNone(opts['-a'])
+        self.assertEqual(opts['--json'], 'aliases.json')
+        self.assertEqual(opts['--output'], 'out')
+
+    def test_redirected_stdout(self):
+        class UnclosableStringIO(io.StringIO):
+            def close(self):
+                pass
+
+        adb = make_test_dict_aliasdb(SIMPLE_ALIAS_DICTS)
+        out = UnclosableStringIO()
+        with contextlib.redirect_stdout(out):
+            aliasdb.process_opts(aliasdb.parse_args(['-s']), adb)
+
+        self.assertEqual('alias lst="ls -lhar --sort time"\n', out.getvalue())